@@ -16,15 +16,21 @@ Funktsiyalar (1-bosqich va ko'p yuqori prioritet elementlar):
 """
 
 import os
-import sqlite3
+import re
+import asyncio
+import bisect
 import logging
 import random
 import datetime
-import math
-import json
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, suppress
+from decimal import Decimal
 from functools import wraps
 from typing import Optional
 
+import aiosqlite
+import orjson
 from telegram import (
     Update,
     KeyboardButton,
@@ -33,30 +39,48 @@ from telegram import (
     InlineKeyboardMarkup,
     Message,
 )
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     ContextTypes,
-    ConversationHandler,
     CallbackQueryHandler,
     filters,
 )
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 # --------------- CONFIG -----------------
 BOT_TOKEN = os.getenv("BOT_TOKEN", "PUT_YOUR_TOKEN_HERE")
 ADMIN_CHANNEL = os.getenv("ADMIN_CHANNEL", "@your_admin_channel")  # channel where orders & logs go
 BASE_URL = os.getenv("BASE_URL", "")  # for OAuth callbacks if used
+# public https url Telegram pushes updates to (needs python-telegram-bot[webhooks]); empty = long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PORT = os.getenv("PORT", "8443")  # parsed only in webhook mode
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None  # checked against Telegram's secret token header
 # GOOGLE_CLIENT_ID / SECRET for YouTube features (placeholders)
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET", "")
 
 # Anti-fraud & limits
-DAILY_MAX_BONUS_PER_USER = 20.0  # safety cap on how much bonus a user can get per day
+# all money amounts are integer kopecks (1 rubl = 100)
+DAILY_MAX_BONUS_PER_USER = 2000  # safety cap on how much bonus a user can get per day
 MAX_REFERRALS_PER_USER = 1000  # arbitrary safety clamp
-MAX_SEND_PER_DAY = 500.0  # cap on money a user can send per day
-MIN_SPIN_COST = 0.0  # if paid spins implemented
+MAX_SEND_PER_DAY = 50000  # cap on money a user can send per day
+MIN_SPIN_COST = 0  # if paid spins implemented
+REFERRAL_BONUS = 400
+RATE_LIMIT_MAX_USERS = 10_000  # per-command rate limiter buckets kept in memory
+CONCURRENT_UPDATES = 256  # updates handled at once across users (one user's run in order); handlers mostly wait on SQLite and the Bot API
+LEADERBOARD_TTL = 30  # seconds a rendered leaderboard is served from memory
+KNOWN_USERS_MAX = 50_000  # user ids ensure_user remembers as already stored
+USER_SYNC_TTL = 3600  # seconds before ensure_user writes an unchanged known user again
+DAILY_AUDIT_AT = datetime.time(0, 5)  # UTC time of day the daily audit runs
+ADMIN_NOTIFY_INTERVAL = 1.0  # seconds between admin channel messages; notifications in between are batched
+ADMIN_NOTIFY_MAX_CHARS = 4000  # Telegram rejects messages over 4096 characters
+
+# database
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # number of reader connections
+DB_STATEMENT_CACHE = 512  # prepared statements kept per connection (sqlite3 default is 128)
 
 # logging
 logging.basicConfig(level=logging.INFO)
@@ -64,11 +88,9 @@ logger = logging.getLogger(__name__)
 
 # --------------- DATABASE -----------------
 DB_PATH = "bot_full.db"
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-cur = conn.cursor()
 
 # Create necessary tables
-cur.executescript("""
+SCHEMA = """
 PRAGMA foreign_keys = ON;
 
 CREATE TABLE IF NOT EXISTS users (
@@ -76,20 +98,20 @@ CREATE TABLE IF NOT EXISTS users (
     username TEXT,
     first_name TEXT,
     last_name TEXT,
-    balance REAL DEFAULT 0,
+    balance INTEGER DEFAULT 0, -- kopecks, like every money column
     last_bonus DATE,
     streak INTEGER DEFAULT 0,
     referred_by INTEGER,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     is_banned INTEGER DEFAULT 0,
-    daily_sent REAL DEFAULT 0
+    daily_sent INTEGER DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS transactions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER,
     type TEXT, -- 'bonus','transfer_in','transfer_out','penalty','reward','quiz','spin'
-    amount REAL,
+    amount INTEGER,
     reason TEXT,
     meta TEXT,
     ts DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -129,7 +151,7 @@ CREATE TABLE IF NOT EXISTS quiz_questions (
     q TEXT,
     options TEXT, -- json list
     answer_index INTEGER,
-    reward REAL DEFAULT 0.2
+    reward INTEGER DEFAULT 20
 );
 
 CREATE TABLE IF NOT EXISTS user_quiz_history (
@@ -143,7 +165,7 @@ CREATE TABLE IF NOT EXISTS user_quiz_history (
 CREATE TABLE IF NOT EXISTS spins (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER,
-    reward REAL,
+    reward INTEGER,
     ts DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -152,7 +174,7 @@ CREATE TABLE IF NOT EXISTS missions (
     code TEXT UNIQUE,
     title TEXT,
     description TEXT,
-    reward REAL,
+    reward INTEGER,
     condition_json TEXT -- flexible conditions in JSON
 );
 
@@ -163,107 +185,375 @@ CREATE TABLE IF NOT EXISTS user_missions (
     completed INTEGER DEFAULT 0,
     completed_at DATETIME
 );
-""")
-conn.commit()
+
+-- lookup indexes for the per-user hot paths; per-day filters use ts ranges (see day_bounds)
+CREATE INDEX IF NOT EXISTS idx_tx_user_ts ON transactions(user_id, ts DESC);
+CREATE INDEX IF NOT EXISTS idx_spins_user_ts ON spins(user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_uqh_user_ts ON user_quiz_history(user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_ref_referrer ON referrals(referrer);
+CREATE INDEX IF NOT EXISTS idx_ref_referred ON referrals(referred);
+CREATE INDEX IF NOT EXISTS idx_um_user_mission ON user_missions(user_id, mission_id);
+CREATE INDEX IF NOT EXISTS idx_users_balance ON users(balance DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+
+-- users.balance is maintained from the ledger: every transaction row moves the balance
+CREATE TRIGGER IF NOT EXISTS trg_tx_balance AFTER INSERT ON transactions
+BEGIN
+    UPDATE users SET balance = balance + NEW.amount WHERE id = NEW.user_id;
+END;
+"""
+SCHEMA_VERSION = 1  # PRAGMA user_version; 1 = money stored as INTEGER kopecks
+
+# money columns that were REAL rubles before schema version 1
+KOPECK_COLUMNS = {
+    "users": ("balance", "daily_sent"),
+    "transactions": ("amount",),
+    "quiz_questions": ("reward",),
+    "spins": ("reward",),
+    "missions": ("reward",),
+}
+
+async def migrate_db(db: aiosqlite.Connection):
+    """Bring an existing database file up to SCHEMA_VERSION; runs before SCHEMA on the writer"""
+    async with db.execute("PRAGMA user_version") as c:
+        version = (await c.fetchone())[0]
+    if version >= SCHEMA_VERSION:
+        return
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='users'") as c:
+        has_data = await c.fetchone() is not None
+    if has_data and version < 1:
+        # SQLite cannot change a column type: rebuild each money table from the SCHEMA definition
+        # (foreign keys are off so the users table can be swapped under transactions)
+        await db.execute("PRAGMA foreign_keys=OFF")
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            # dropped with its table anyway; SCHEMA recreates it together with the indexes
+            await db.execute("DROP TRIGGER IF EXISTS trg_tx_balance")
+            for table, money_cols in KOPECK_COLUMNS.items():
+                body = re.search(rf"CREATE TABLE IF NOT EXISTS {table} \((.*?)\n\);", SCHEMA, re.S).group(1)
+                async with db.execute(f"PRAGMA table_info({table})") as c:
+                    cols = [row[1] for row in await c.fetchall()]
+                select = ", ".join(f"CAST(ROUND({col} * 100) AS INTEGER)" if col in money_cols else col for col in cols)
+                await db.execute(f"CREATE TABLE {table}_new ({body}\n)")
+                await db.execute(f"INSERT INTO {table}_new ({', '.join(cols)}) SELECT {select} FROM {table}")
+                await db.execute(f"DROP TABLE {table}")
+                await db.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        finally:
+            await db.execute("PRAGMA foreign_keys=ON")
+        logger.info("Migrated money columns to integer kopecks")
+    await db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    await db.commit()
+
+class SqlitePool:
+    """One dedicated writer connection plus a queue of reader connections.
+
+    SQLite allows a single writer at a time, so all writes share one connection
+    guarded by a lock (no SQLITE_BUSY between our own coroutines), while readers
+    run in parallel under WAL.
+    """
+
+    def __init__(self, path: str, size: int = 5):
+        self.path = path
+        self.size = size
+        # created in open(), on the loop the bot runs on (asyncio primitives bind to a loop before 3.10)
+        self._readers: Optional[asyncio.Queue] = None
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=DB_STATEMENT_CACHE)
+        # WAL lets readers run alongside the single writer; NORMAL sync is safe under WAL
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA temp_store=MEMORY")
+        await conn.execute("PRAGMA mmap_size=268435456")
+        await conn.execute("PRAGMA cache_size=-65536")
+        await conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    async def open(self):
+        """Open all connections and create the schema"""
+        self._readers = asyncio.Queue()
+        self._write_lock = asyncio.Lock()
+        self._writer = await self._connect()
+        await migrate_db(self._writer)
+        await self._writer.executescript(SCHEMA)
+        await self._writer.commit()
+        for _ in range(self.size):
+            self._readers.put_nowait(await self._connect())
+
+    async def close(self):
+        while self._readers is not None and not self._readers.empty():
+            await self._readers.get_nowait().close()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def reader(self):
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Exclusive access to the writer as one BEGIN IMMEDIATE transaction.
+
+        Commits on success, rolls back on error. Never nest writer() blocks.
+        """
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            await self._writer.commit()
+
+pool = SqlitePool(DB_PATH, DB_POOL_SIZE)
 
 # --------------- UTILITIES -----------------
-def db_commit():
-    conn.commit()
-
-def ensure_user(user_id: int, user_obj: Optional[Message]=None, referred_by: Optional[int]=None):
-    """Create user row if not exists and update basic info"""
-    cur.execute("SELECT id FROM users WHERE id=?", (user_id,))
-    if cur.fetchone() is None:
-        username = user_obj.from_user.username if user_obj else None
-        first = user_obj.from_user.first_name if user_obj else None
-        last = user_obj.from_user.last_name if user_obj else None
-        cur.execute(
-            "INSERT INTO users (id, username, first_name, last_name, referred_by) VALUES (?, ?, ?, ?, ?)",
-            (user_id, username, first, last, referred_by)
+def dumps_json(obj) -> str:
+    # orjson writes UTF-8 as is, same as json.dumps(..., ensure_ascii=False)
+    return orjson.dumps(obj).decode()
+
+class OrjsonRequest(HTTPXRequest):
+    """HTTPXRequest that decodes Bot API responses (every getUpdates batch included) with orjson"""
+    __slots__ = ()
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # invalid UTF-8 or JSON: PTB's parser decodes with replacement and reports it
+            return HTTPXRequest.parse_json_payload(payload)
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handles updates of different users concurrently and the updates of one user in arrival order
+
+    Multi-step flows keep their state in user_data, so a user's next message must not start before
+    the previous one is handled. A user's queued updates wait on their lock before taking one of the
+    max_concurrent_updates slots, so one busy user cannot hold up everyone else.
+    """
+    __slots__ = ('_user_locks',)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # user id -> [lock, updates of that user in flight]; dropped when the last one finishes
+        self._user_locks = {}
+
+    async def process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._user_locks.get(user.id)
+        if entry is None:
+            entry = self._user_locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+# user id -> (monotonic ts of last write, (username, first_name, last_name) or None), least recently used first
+_known_users = OrderedDict()
+
+async def ensure_user(user_id: int, user_obj: Optional[Message]=None, referred_by: Optional[int]=None):
+    """Create user row if not exists and update basic info (one statement either way)
+
+    Skipped for users written in the last USER_SYNC_TTL seconds whose names did not change;
+    referred_by only matters on insert, so it never forces a write for a known user.
+    """
+    names = None
+    if user_obj is not None:
+        names = (user_obj.from_user.username, user_obj.from_user.first_name, user_obj.from_user.last_name)
+    now = time.monotonic()
+    known = _known_users.get(user_id)
+    if known is not None:
+        _known_users.move_to_end(user_id)
+        if now - known[0] < USER_SYNC_TTL and (names is None or names == known[1]):
+            return
+    await _write_user(user_id, names, referred_by)
+    _known_users[user_id] = (now, names if names is not None else known and known[1])
+    if len(_known_users) > KNOWN_USERS_MAX:
+        _known_users.popitem(last=False)
+
+async def _write_user(user_id: int, names: Optional[tuple], referred_by: Optional[int]):
+    async with pool.writer() as db:
+        if names is None:
+            await db.execute("INSERT OR IGNORE INTO users (id, referred_by) VALUES (?, ?)", (user_id, referred_by))
+            return
+        # referred_by is only set on insert, never overwritten
+        await db.execute(
+            """INSERT INTO users (id, username, first_name, last_name, referred_by) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(id) DO UPDATE SET
+                   username=excluded.username, first_name=excluded.first_name, last_name=excluded.last_name""",
+            (user_id, *names, referred_by)
         )
-        db_commit()
-    else:
-        # update possible username/first_name changes
-        if user_obj:
-            cur.execute(
-                "UPDATE users SET username=?, first_name=?, last_name=? WHERE id=?",
-                (user_obj.from_user.username, user_obj.from_user.first_name, user_obj.from_user.last_name, user_id)
-            )
-            db_commit()
-
-def get_balance(user_id: int) -> float:
-    cur.execute("SELECT balance FROM users WHERE id=?", (user_id,))
-    row = cur.fetchone()
-    return float(row[0]) if row else 0.0
-
-def add_transaction(user_id: int, ttype: str, amount: float, reason: str="", meta: dict=None):
-    """Add transaction and update balance atomically"""
+
+async def get_balance(user_id: int) -> int:
+    async with pool.reader() as db:
+        async with db.execute("SELECT balance FROM users WHERE id=?", (user_id,)) as c:
+            row = await c.fetchone()
+    return row[0] if row else 0
+
+async def _stage_transaction(db: aiosqlite.Connection, user_id: int, ttype: str, amount: int, reason: str="", meta: dict=None):
+    """Add transaction on the writer connection without committing (trg_tx_balance updates the balance).
+
+    The user row must already exist (callers run ensure_user first); the
+    transactions.user_id foreign key rejects unknown users.
+    """
     if meta is None:
         meta = {}
-    # Ensure user exists
-    cur.execute("INSERT OR IGNORE INTO users (id) VALUES (?)", (user_id,))
-    # Update balance
-    cur.execute("UPDATE users SET balance = balance + ? WHERE id=?", (amount, user_id))
-    meta_json = json.dumps(meta, ensure_ascii=False)
-    cur.execute(
+    meta_json = dumps_json(meta)
+    await db.execute(
         "INSERT INTO transactions (user_id, type, amount, reason, meta) VALUES (?, ?, ?, ?, ?)",
         (user_id, ttype, amount, reason, meta_json)
     )
-    db_commit()
+    invalidate_leaderboard(user_id)
 
-def safe_round(amount: float) -> float:
-    # Round to 2 decimals carefully
-    return round(float(math.floor(amount * 100 + 0.5)) / 100.0, 2)
-
-def can_receive_bonus_today(user_id: int) -> bool:
-    cur.execute("SELECT last_bonus FROM users WHERE id=?", (user_id,))
-    row = cur.fetchone()
+async def add_transaction(user_id: int, ttype: str, amount: int, reason: str="", meta: dict=None):
+    """Add transaction and update balance atomically"""
+    async with pool.writer() as db:
+        await _stage_transaction(db, user_id, ttype, amount, reason, meta)
+
+async def commit_transfer(sender: int, recipient: int, amount: int) -> bool:
+    """Move money between users in one transaction; False if the sender's balance is too low"""
+    async with pool.writer() as db:
+        # re-check balance under the write lock so concurrent transfers cannot overdraw
+        async with db.execute("SELECT balance FROM users WHERE id=?", (sender,)) as c:
+            row = await c.fetchone()
+        if not row or amount > row[0]:
+            return False
+        await _stage_transaction(db, sender, "transfer_out", -amount, f"to {recipient}", {"to": recipient})
+        await _stage_transaction(db, recipient, "transfer_in", amount, f"from {sender}", {"from": sender})
+        # update daily_sent
+        await db.execute("UPDATE users SET daily_sent = daily_sent + ? WHERE id=?", (amount, sender))
+    return True
+
+def day_bounds(day: datetime.date):
+    """[start, end) ts strings for a calendar day, so per-day filters can use the (user_id, ts) indexes"""
+    return day.isoformat(), (day + datetime.timedelta(days=1)).isoformat()
+
+def to_kop(rubl) -> int:
+    # rubl amount (float/Decimal) -> integer kopecks
+    return int(round(rubl * 100))
+
+def fmt_rub(kop: int) -> str:
+    # integer kopecks -> "12.50" for messages
+    return f"{kop / 100:.2f}"
+
+async def can_receive_bonus_today(user_id: int) -> bool:
+    async with pool.reader() as db:
+        async with db.execute("SELECT last_bonus FROM users WHERE id=?", (user_id,)) as c:
+            row = await c.fetchone()
     if not row or not row[0]:
         return True
     last = row[0]
     today = datetime.date.today().isoformat()
     return last != today
 
-def update_last_bonus_and_streak(user_id: int, bonus_amount: float):
-    cur.execute("SELECT last_bonus, streak FROM users WHERE id=?", (user_id,))
-    row = cur.fetchone()
+async def update_last_bonus_and_streak(db: aiosqlite.Connection, user_id: int, bonus_amount: int):
+    # runs on the caller's writer connection, committed together with the bonus transaction
+    async with db.execute("SELECT last_bonus, streak FROM users WHERE id=?", (user_id,)) as c:
+        row = await c.fetchone()
     last_bonus, streak = (row if row else (None, 0))
     today = datetime.date.today().isoformat()
+    if last_bonus == today:
+        # a concurrent update took today's bonus after can_receive_bonus_today passed
+        return None
     yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
     if last_bonus == yesterday:
         streak = (streak or 0) + 1
     else:
         streak = 1
-    cur.execute("UPDATE users SET last_bonus=?, streak=? WHERE id=?", (today, streak, user_id))
-    db_commit()
+    await db.execute("UPDATE users SET last_bonus=?, streak=? WHERE id=?", (today, streak, user_id))
     return streak
 
 def notify_admin(app, text: str):
-    # send message to admin channel (non-blocking)
-    try:
-        app.bot.send_message(ADMIN_CHANNEL, text)
-    except Exception as e:
-        logger.warning("Notify admin failed: %s", e)
+    # queue message for the admin channel (non-blocking); admin_notifier sends it in the background
+    app.bot_data['admin_queue'].put_nowait(text)
+
+async def admin_notifier(app):
+    """Send queued notify_admin lines, coalescing whatever piled up into one message per ADMIN_NOTIFY_INTERVAL"""
+    queue = app.bot_data['admin_queue']
+    pending = deque()
+    stopping = False
+    while pending or not stopping:
+        if not pending:
+            pending.append(await queue.get())
+        while not queue.empty():
+            pending.append(queue.get_nowait())
+        if None in pending:
+            pending.remove(None)
+            stopping = True
+        batch, size = [], 0
+        while pending and size + len(pending[0]) < ADMIN_NOTIFY_MAX_CHARS:
+            size += len(pending[0]) + 1
+            batch.append(pending.popleft())
+        if pending and not batch:
+            # a single line over the limit
+            batch.append(pending.popleft()[:ADMIN_NOTIFY_MAX_CHARS])
+        if batch:
+            try:
+                await app.bot.send_message(ADMIN_CHANNEL, "\n".join(batch))
+            except Exception as e:
+                logger.warning("Notify admin failed: %s", e)
+        if not stopping:
+            await asyncio.sleep(ADMIN_NOTIFY_INTERVAL)
 
 # --------------- ANTI-FRAUD HELPERS -----------------
+class TokenBucket:
+    __slots__ = ("tokens", "ts")
+
+    def __init__(self, tokens: float, ts: float):
+        self.tokens = tokens
+        self.ts = ts
+
 def rate_limited(max_per_minute=10):
-    # simplistic in-memory rate limiter per user
-    calls = {}
+    # in-memory token bucket per user: holds up to max_per_minute tokens, refilled
+    # continuously over a minute; least recently seen users are evicted past RATE_LIMIT_MAX_USERS
+    rate = max_per_minute / 60.0
+    buckets = OrderedDict()
     def decorator(func):
         @wraps(func)
         async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
             user = update.effective_user
             uid = user.id if user else 0
-            now = datetime.datetime.utcnow().timestamp()
-            window = 60
-            user_calls = calls.get(uid, [])
-            # remove old
-            user_calls = [t for t in user_calls if now - t < window]
-            if len(user_calls) >= max_per_minute:
+            now = time.monotonic()
+            bucket = buckets.get(uid)
+            if bucket is None:
+                bucket = buckets[uid] = TokenBucket(max_per_minute, now)
+                if len(buckets) > RATE_LIMIT_MAX_USERS:
+                    buckets.popitem(last=False)
+            else:
+                buckets.move_to_end(uid)
+                bucket.tokens = min(max_per_minute, bucket.tokens + (now - bucket.ts) * rate)
+                bucket.ts = now
+            if bucket.tokens < 1:
                 await update.message.reply_text("⏱ Siz juda tez harakat qilyapsiz. Iltimos biroz kuting.")
                 return
-            user_calls.append(now)
-            calls[uid] = user_calls
+            bucket.tokens -= 1
             return await func(update, context, *args, **kwargs)
         return wrapper
     return decorator
@@ -282,17 +572,23 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 ref_id = int(a[3:])
             except:
                 ref_id = None
-    ensure_user(user.id, update.message, ref_id)
+    await ensure_user(user.id, update.message, ref_id)
     # if referred
     if ref_id and ref_id != user.id:
         # prevent double awarding for same referred: check referrals table
-        cur.execute("SELECT id FROM referrals WHERE referred=?",(user.id,))
-        if cur.fetchone() is None:
-            cur.execute("INSERT INTO referrals (referrer, referred) VALUES (?, ?)", (ref_id, user.id))
-            add_transaction(ref_id, "referral", 4.0, f"Referral for {user.id}", {"referred": user.id})
-            db_commit()
+        # only known users can be referrers; a made-up ref id earns nothing
+        async with pool.writer() as db:
+            async with db.execute("SELECT id FROM referrals WHERE referred=?", (user.id,)) as c:
+                is_new = await c.fetchone() is None
+            if is_new:
+                async with db.execute("SELECT id FROM users WHERE id=?", (ref_id,)) as c:
+                    is_new = await c.fetchone() is not None
+            if is_new:
+                await db.execute("INSERT INTO referrals (referrer, referred) VALUES (?, ?)", (ref_id, user.id))
+                await _stage_transaction(db, ref_id, "referral", REFERRAL_BONUS, f"Referral for {user.id}", {"referred": user.id})
+        if is_new:
             try:
-                await context.bot.send_message(ref_id, f"🎉 Sizga +4 rubl referal bonusi! (ID: {user.id})")
+                await context.bot.send_message(ref_id, f"🎉 Sizga +{fmt_rub(REFERRAL_BONUS)} rubl referal bonusi! (ID: {user.id})")
             except Exception:
                 pass
 
@@ -305,10 +601,10 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [KeyboardButton("📝 Buyurtma berish")]
     ]
     markup = ReplyKeyboardMarkup(kb, resize_keyboard=True)
-    ref_link = f"https://t.me/{(await context.bot.get_me()).username}?start=ref{user.id}"
+    ref_link = f"https://t.me/{context.bot_data['bot_username']}?start=ref{user.id}"
     await update.message.reply_text(
         f"Assalomu alaykum, {user.first_name}!\n"
-        f"Balans: {safe_round(get_balance(user.id))} rubl\n"
+        f"Balans: {fmt_rub(await get_balance(user.id))} rubl\n"
         f"Referal havolangiz:\n{ref_link}",
         reply_markup=markup
     )
@@ -316,55 +612,65 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ----- BALANCE & TRANSACTIONS -----
 async def balance_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    ensure_user(uid, update.message)
-    bal = safe_round(get_balance(uid))
-    await update.message.reply_text(f"💰 Balansingiz: {bal} rubl")
+    await ensure_user(uid, update.message)
+    bal = await get_balance(uid)
+    await update.message.reply_text(f"💰 Balansingiz: {fmt_rub(bal)} rubl")
 
 async def transactions_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    cur.execute("SELECT ts, type, amount, reason FROM transactions WHERE user_id=? ORDER BY ts DESC LIMIT 20", (uid,))
-    rows = cur.fetchall()
+    async with pool.reader() as db:
+        async with db.execute("SELECT ts, type, amount, reason FROM transactions WHERE user_id=? ORDER BY ts DESC LIMIT 20", (uid,)) as c:
+            rows = await c.fetchall()
     if not rows:
         await update.message.reply_text("📭 Sizda tranzaksiyalar yo‘q.")
         return
     text = "📜 So'nggi tranzaksiyalar:\n"
     for ts, ttype, amt, reason in rows:
-        text += f"{ts.split('.')[0]} — {amt:+} rubl — {ttype} — {reason}\n"
+        text += f"{ts.split('.')[0]} — {amt / 100:+.2f} rubl — {ttype} — {reason}\n"
     await update.message.reply_text(text)
 
 # ----- DAILY BONUS -----
 @rate_limited(max_per_minute=6)
 async def daily_bonus_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    ensure_user(uid, update.message)
-    if not can_receive_bonus_today(uid):
+    await ensure_user(uid, update.message)
+    if not await can_receive_bonus_today(uid):
         await update.message.reply_text("⚠️ Siz bugungi bonusni allaqachon olgansiz. Ertaga yana urinib ko‘ring.")
         return
     # base random bonus
-    base = round(random.uniform(0.2, 5.0), 2)
-    # update streak
-    streak = update_last_bonus_and_streak(uid, base)  # returns new streak
-    streak_bonus = round(streak * 0.2, 2)
-    total = safe_round(base + streak_bonus)
-    # safety clamp per day
-    if total > DAILY_MAX_BONUS_PER_USER:
-        total = DAILY_MAX_BONUS_PER_USER
-    add_transaction(uid, "bonus", total, f"daily_bonus (base {base} + streak {streak_bonus})", {"streak": streak})
+    base = random.randint(20, 500)
+    async with pool.writer() as db:
+        # update streak
+        streak = await update_last_bonus_and_streak(db, uid, base)  # returns new streak, None if already taken today
+        if streak is not None:
+            streak_bonus = streak * 20
+            total = base + streak_bonus
+            # safety clamp per day
+            if total > DAILY_MAX_BONUS_PER_USER:
+                total = DAILY_MAX_BONUS_PER_USER
+            await _stage_transaction(db, uid, "bonus", total, f"daily_bonus (base {fmt_rub(base)} + streak {fmt_rub(streak_bonus)})", {"streak": streak})
+    if streak is None:
+        await update.message.reply_text("⚠️ Siz bugungi bonusni allaqachon olgansiz. Ertaga yana urinib ko‘ring.")
+        return
     await update.message.reply_text(
-        f"🎁 Bugungi bonus: {base} rubl\n🔥 Ketma-ket: {streak} kun (+{streak_bonus} rubl)\n"
-        f"✅ Jami qo‘shildi: {total} rubl\nBalans: {safe_round(get_balance(uid))} rubl"
+        f"🎁 Bugungi bonus: {fmt_rub(base)} rubl\n🔥 Ketma-ket: {streak} kun (+{fmt_rub(streak_bonus)} rubl)\n"
+        f"✅ Jami qo‘shildi: {fmt_rub(total)} rubl\nBalans: {fmt_rub(await get_balance(uid))} rubl"
     )
     # admin notify
-    notify_admin(context.application, f"👤 {uid} bonus oldi: {total} rubl (streak {streak})")
+    notify_admin(context.application, f"👤 {uid} bonus oldi: {fmt_rub(total)} rubl (streak {streak})")
 
 # ----- SEND MONEY FLOW -----
-SEND_RECIPIENT, SEND_AMOUNT, SEND_CONFIRM = range(3)
+# steps of the typed-input flows (send money, order); the current one is kept in user_data['step'],
+# so starting one flow ends whichever other flow was waiting (see STEP_ROUTES)
+SEND_RECIPIENT, SEND_AMOUNT, SEND_CONFIRM, ORDER_TEXT = range(4)
+AMOUNT_RE = re.compile(r"^(\d{1,6})(?:\.(\d{1,2}))?$")  # up to 6 integer digits and 2 decimals
 
+@rate_limited(max_per_minute=10)
 async def send_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    ensure_user(uid, update.message)
+    await ensure_user(uid, update.message)
     await update.message.reply_text("📤 Pul yuborish: qabul qiluvchining ID sini kiriting (raqam):")
-    return SEND_RECIPIENT
+    context.user_data['step'] = SEND_RECIPIENT
 
 async def send_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
@@ -378,40 +684,30 @@ async def send_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def send_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip().replace(",", ".")
-    try:
-        # digit-by-digit style: validate chars
-        parts = text.split(".")
-        if len(parts) > 2:
-            raise ValueError
-        int_part = parts[0] if parts[0] != "" else "0"
-        frac_part = parts[1] if len(parts) == 2 else "0"
-        if not int_part.lstrip("-").isdigit() or not frac_part.isdigit():
-            raise ValueError
-        if len(frac_part) > 2:
-            frac_part = frac_part[:2]
-        amount = float(int_part) + float("0." + frac_part) if not int_part.startswith("-") else - (float(int_part.lstrip("-")) + float("0." + frac_part))
-    except Exception:
+    m = AMOUNT_RE.match(text)
+    if not m:
         await update.message.reply_text("❗ Noto'g'ri summa. Iltimos son kiriting (masalan: 1 yoki 0.5).")
         return SEND_AMOUNT
-
-    amount = safe_round(amount)
+    # at most 2 decimals, so the kopeck amount is exact
+    amount = to_kop(Decimal(f"{m.group(1)}.{m.group(2) or '0'}"))
     if amount <= 0:
         await update.message.reply_text("❗ Iltimos, musbat summa kiriting.")
         return SEND_AMOUNT
 
     sender = update.effective_user.id
-    bal = get_balance(sender)
+    bal = await get_balance(sender)
     if amount > bal:
-        await update.message.reply_text(f"⚠️ Sizda yetarli mablag‘ yo‘q. Balans: {bal} rubl")
-        return ConversationHandler.END
+        await update.message.reply_text(f"⚠️ Sizda yetarli mablag‘ yo‘q. Balans: {fmt_rub(bal)} rubl")
+        return None
 
     # daily send limit check
-    cur.execute("SELECT daily_sent FROM users WHERE id=?", (sender,))
-    row = cur.fetchone()
-    daily_sent = float(row[0]) if row and row[0] else 0.0
+    async with pool.reader() as db:
+        async with db.execute("SELECT daily_sent FROM users WHERE id=?", (sender,)) as c:
+            row = await c.fetchone()
+    daily_sent = row[0] if row and row[0] else 0
     if (daily_sent + amount) > MAX_SEND_PER_DAY:
         await update.message.reply_text("⚠️ Bugungi yuborish limitiga yetdingiz.")
-        return ConversationHandler.END
+        return None
 
     context.user_data['send_amount'] = amount
     rec = context.user_data['send_recipient']
@@ -419,7 +715,7 @@ async def send_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("✅ Tasdiqlash", callback_data="confirm_send"), InlineKeyboardButton("❌ Bekor", callback_data="cancel_send")]
     ])
-    await update.message.reply_text(f"Yuborishni tasdiqlaysizmi?\nID: {rec}\nSumma: {amount} rubl", reply_markup=kb)
+    await update.message.reply_text(f"Yuborishni tasdiqlaysizmi?\nID: {rec}\nSumma: {fmt_rub(amount)} rubl", reply_markup=kb)
     return SEND_CONFIRM
 
 async def send_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -427,246 +723,214 @@ async def send_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     user = q.from_user.id
     data = q.data
+    # only the latest confirmation counts; a second tap or an old message finds no step
+    if context.user_data.get('step') != SEND_CONFIRM:
+        await q.edit_message_text("❗ Ma'lumot topilmadi.")
+        return
+    del context.user_data['step']
     if data == "cancel_send":
         await q.edit_message_text("❌ Pul yuborish bekor qilindi.")
-        return ConversationHandler.END
+        return
     rec = context.user_data.get('send_recipient')
     amt = context.user_data.get('send_amount')
     if rec is None or amt is None:
         await q.edit_message_text("❗ Ma'lumot topilmadi.")
-        return ConversationHandler.END
+        return
     # ensure recipient exists
-    ensure_user(rec)
-    # re-check balance
-    bal = get_balance(user)
-    if amt > bal:
-        await q.edit_message_text(f"⚠️ Sizda endi yetarli mablag' yo'q. Balans: {bal}")
-        return ConversationHandler.END
-    # perform atomic-ish transfer
-    add_transaction(user, "transfer_out", -amt, f"to {rec}", {"to": rec})
-    add_transaction(rec, "transfer_in", amt, f"from {user}", {"from": user})
-    # update daily_sent
-    cur.execute("UPDATE users SET daily_sent = daily_sent + ? WHERE id=?", (amt, user))
-    db_commit()
-    await q.edit_message_text(f"✅ Muvaffaqiyatli! {amt} rubl yuborildi (ID: {rec}).")
+    await ensure_user(rec)
+    # atomic transfer; re-checks the balance inside the transaction
+    if not await commit_transfer(user, rec, amt):
+        bal = await get_balance(user)
+        await q.edit_message_text(f"⚠️ Sizda endi yetarli mablag' yo'q. Balans: {fmt_rub(bal)}")
+        return
+    await q.edit_message_text(f"✅ Muvaffaqiyatli! {fmt_rub(amt)} rubl yuborildi (ID: {rec}).")
     try:
-        await context.bot.send_message(rec, f"📥 Sizga {amt} rubl yuborildi! Jo'natuvchi ID: {user}\nBalansingiz: {safe_round(get_balance(rec))} rubl")
+        await context.bot.send_message(rec, f"📥 Sizga {fmt_rub(amt)} rubl yuborildi! Jo'natuvchi ID: {user}\nBalansingiz: {fmt_rub(await get_balance(rec))} rubl")
     except Exception:
         # recipient may not have started bot; ignore
         pass
     # admin notify
-    notify_admin(context.application, f"💸 Transfer: {user} -> {rec} : {amt} rubl")
-    return ConversationHandler.END
+    notify_admin(context.application, f"💸 Transfer: {user} -> {rec} : {fmt_rub(amt)} rubl")
 
 # ----- ORDER (Buyurtma) -----
 async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    ensure_user(uid, update.message)
+    await ensure_user(uid, update.message)
     await update.message.reply_text("📝 Buyurtma matnini yozing (mahsulot, aloqa, manzil):")
-    context.user_data['awaiting_order'] = True
+    context.user_data['step'] = ORDER_TEXT
 
 async def order_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('awaiting_order'):
-        uid = update.effective_user.id
-        text = update.message.text
-        cur.execute("INSERT INTO orders (user_id, text) VALUES (?, ?)", (uid, text))
-        db_commit()
-        # send to admin channel
-        try:
-            await context.bot.send_message(ADMIN_CHANNEL, f"🆕 Yangi buyurtma\nUser: {uid}\nText: {text}")
-        except Exception:
-            pass
-        context.user_data['awaiting_order'] = False
-        await update.message.reply_text("✅ Buyurtmangiz qabul qilindi. Tez orada adminlar bog'lanadi.")
-    else:
-        await update.message.reply_text("Noma'lum xabar. Menyudan biror tugmani tanlang.")
+    uid = update.effective_user.id
+    text = update.message.text
+    async with pool.writer() as db:
+        await db.execute("INSERT INTO orders (user_id, text) VALUES (?, ?)", (uid, text))
+    # send to admin channel
+    try:
+        await context.bot.send_message(ADMIN_CHANNEL, f"🆕 Yangi buyurtma\nUser: {uid}\nText: {text}")
+    except Exception:
+        pass
+    await update.message.reply_text("✅ Buyurtmangiz qabul qilindi. Tez orada adminlar bog'lanadi.")
+    return None
 
 # ----- QUIZ (Daily Quiz) -----
-# conversation flow: user presses Daily Quiz -> serve 1 question at random (not yet answered today)
-QUIZ_ASK, QUIZ_ANSWER = range(2)
-
-def get_random_quiz_question(user_id: int):
+# flow: user presses Daily Quiz -> serve 1 question at random (not yet answered today);
+# the answer comes back as an inline button (see CB_ROUTES) and is matched to user_data['current_quiz']
+
+async def load_quiz_questions(app):
+    """(Re)load the quiz bank into bot_data['questions']; call again after changing quiz_questions"""
+    async with pool.reader() as db:
+        async with db.execute("SELECT id, q, options, answer_index, reward FROM quiz_questions") as c:
+            rows = await c.fetchall()
+    app.bot_data['questions'] = {
+        qid: {"id": qid, "q": qtext, "options": orjson.loads(opts_json), "answer_index": answer_index, "reward": reward}
+        for qid, qtext, opts_json, answer_index, reward in rows
+    }
+
+async def get_random_quiz_question(user_id: int, questions: dict):
     # select question not answered yet today by user; fallback random
-    today = datetime.date.today().isoformat()
-    cur.execute("""
-        SELECT q.id, q.q, q.options, q.answer_index, q.reward
-        FROM quiz_questions q
-        WHERE q.id NOT IN (
-            SELECT question_id FROM user_quiz_history WHERE user_id=? AND DATE(ts)=?
-        )
-        ORDER BY RANDOM() LIMIT 1
-    """, (user_id, today))
-    row = cur.fetchone()
-    if not row:
-        # allow repeat if none left
-        cur.execute("SELECT id, q, options, answer_index, reward FROM quiz_questions ORDER BY RANDOM() LIMIT 1")
-        row = cur.fetchone()
-    if not row:
+    if not questions:
         return None
-    qid, qtext, opts_json, answer_index, reward = row
-    options = json.loads(opts_json)
-    return {"id": qid, "q": qtext, "options": options, "answer_index": answer_index, "reward": float(reward)}
-
+    day_start, day_end = day_bounds(datetime.date.today())
+    async with pool.reader() as db:
+        async with db.execute("SELECT question_id FROM user_quiz_history WHERE user_id=? AND ts >= ? AND ts < ?",
+                              (user_id, day_start, day_end)) as c:
+            answered = {qid for (qid,) in await c.fetchall()}
+    fresh = [qid for qid in questions if qid not in answered]
+    return questions[random.choice(fresh or list(questions))]
+
+@rate_limited(max_per_minute=10)
 async def quiz_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    ensure_user(uid, update.message)
-    q = get_random_quiz_question(uid)
+    await ensure_user(uid, update.message)
+    q = await get_random_quiz_question(uid, context.bot_data.get('questions'))
     if not q:
         await update.message.reply_text("❗ Hozircha savollar mavjud emas. Keyinroq urinib ko'ring.")
-        return ConversationHandler.END
+        return
     # send question with inline options
     buttons = [InlineKeyboardButton(opt, callback_data=f"quiz|{q['id']}|{i}") for i, opt in enumerate(q['options'])]
     kb = InlineKeyboardMarkup([buttons[i:i+1] for i in range(len(buttons))])  # one per line
     context.user_data['current_quiz'] = q
     await update.message.reply_text(f"❓ {q['q']}", reply_markup=kb)
-    return QUIZ_ANSWER
 
 async def quiz_answer_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    qobj = context.user_data.get('current_quiz')
-    if not qobj:
-        await update.callback_query.answer("❗ Vaqt o'tib ketgan yoki savol topilmadi.")
-        return
     query = update.callback_query
-    await query.answer()
     payload = query.data  # format: quiz|qid|selected_index
     try:
         _, qid_str, sel_str = payload.split("|")
-        sel = int(sel_str)
+        qid, sel = int(qid_str), int(sel_str)
     except:
+        await query.answer()
         await query.edit_message_text("❗ Noto'g'ri ma'lumot.")
-        return ConversationHandler.END
+        return
+    # only the question last served counts (not an older quiz message); taken before the
+    # first await, so with concurrent updates a double tap cannot answer twice
+    qobj = context.user_data.get('current_quiz')
+    if not qobj or qobj['id'] != qid:
+        await query.answer("❗ Vaqt o'tib ketgan yoki savol topilmadi.")
+        return
+    del context.user_data['current_quiz']
+    await query.answer()
     correct = 1 if sel == qobj['answer_index'] else 0
     # store history
-    cur.execute("INSERT INTO user_quiz_history (user_id, question_id, correct) VALUES (?, ?, ?)",
-                (query.from_user.id, qobj['id'], correct))
-    db_commit()
+    reward = qobj['reward']
+    async with pool.writer() as db:
+        await db.execute("INSERT INTO user_quiz_history (user_id, question_id, correct) VALUES (?, ?, ?)",
+                         (query.from_user.id, qobj['id'], correct))
+        if correct:
+            await _stage_transaction(db, query.from_user.id, "quiz", reward, f"quiz q{qobj['id']}", {"question": qobj['id']})
     if correct:
-        reward = float(qobj['reward'])
-        add_transaction(query.from_user.id, "quiz", reward, f"quiz q{qobj['id']}", {"question": qobj['id']})
-        await query.edit_message_text(f"✅ To'g'ri! Siz {reward} rubl oldingiz.")
-        notify_admin(context.application, f"🎓 Quiz: {query.from_user.id} got q{qobj['id']} correct. +{reward}")
+        await query.edit_message_text(f"✅ To'g'ri! Siz {fmt_rub(reward)} rubl oldingiz.")
+        notify_admin(context.application, f"🎓 Quiz: {query.from_user.id} got q{qobj['id']} correct. +{fmt_rub(reward)}")
     else:
         await query.edit_message_text("❌ Xato javob. Keyingi qiynog'ingizga omad tilaymiz!")
-    # cleanup
-    context.user_data.pop('current_quiz', None)
-    return ConversationHandler.END
 
 # ----- SPIN WHEEL -----
-SPIN_CONFIRM = range(1)
-
-def spin_rewards_table():
-    # weighted rewards: reward -> weight
-    return [
-        (0.0, 10),  # nothing
-        (0.2, 25),
-        (0.5, 20),
-        (1.0, 15),
-        (2.0, 10),
-        (5.0, 5),
-        (10.0, 1)
-    ]
+# weighted rewards (kopecks) with cumulative weights;
+# weights 10 (nothing), 25, 20, 15, 10, 5, 1
+_SPIN_REWARDS = (0, 20, 50, 100, 200, 500, 1000)
+_SPIN_CUMW = (10, 35, 55, 70, 80, 85, 86)
 
 def spin_once():
-    table = spin_rewards_table()
-    total_weight = sum(w for _, w in table)
-    r = random.randint(1, total_weight)
-    upto = 0
-    for reward, weight in table:
-        upto += weight
-        if r <= upto:
-            return float(reward)
-    return 0.0
+    return _SPIN_REWARDS[bisect.bisect_left(_SPIN_CUMW, random.randint(1, _SPIN_CUMW[-1]))]
 
+@rate_limited(max_per_minute=6)
 async def spin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    ensure_user(uid, update.message)
+    await ensure_user(uid, update.message)
     # allow once per day free spin: check spins table for today
-    today = datetime.date.today().isoformat()
-    cur.execute("SELECT COUNT(*) FROM spins WHERE user_id=? AND DATE(ts)=?", (uid, today))
-    cnt = cur.fetchone()[0]
+    # (under the write lock, so concurrent presses cannot both spin)
+    day_start, day_end = day_bounds(datetime.date.today())
+    reward = spin_once()
+    async with pool.writer() as db:
+        async with db.execute("SELECT COUNT(*) FROM spins WHERE user_id=? AND ts >= ? AND ts < ?", (uid, day_start, day_end)) as c:
+            cnt = (await c.fetchone())[0]
+        if cnt == 0:
+            await _stage_transaction(db, uid, "spin", reward, f"daily_spin", {"reward": reward})
+            await db.execute("INSERT INTO spins (user_id, reward) VALUES (?, ?)", (uid, reward))
     if cnt >= 1:
         await update.message.reply_text("⚠️ Bugun bepul spin allaqachon ishlatilgan. Keyingi spin uchun shopga qarang.")
         return
-    # spin
-    reward = spin_once()
-    add_transaction(uid, "spin", reward, f"daily_spin", {"reward": reward})
-    cur.execute("INSERT INTO spins (user_id, reward) VALUES (?, ?)", (uid, reward))
-    db_commit()
     if reward > 0:
-        await update.message.reply_text(f"🎉 Ajoyib! Siz {reward} rubl yutdingiz. Balans: {safe_round(get_balance(uid))} rubl")
+        await update.message.reply_text(f"🎉 Ajoyib! Siz {fmt_rub(reward)} rubl yutdingiz. Balans: {fmt_rub(await get_balance(uid))} rubl")
     else:
         await update.message.reply_text("😕 Afsus, hech narsa yutmadingiz. Ertaga yana urinib ko'ring!")
-    notify_admin(context.application, f"🎡 Spin: {uid} reward {reward}")
+    notify_admin(context.application, f"🎡 Spin: {uid} reward {fmt_rub(reward)}")
 
 # ----- MISSIONS & SHOP -----
 # simple mission example: follow X channels + like some short -> for now we implement simple tasks with progress manually
-def create_sample_missions():
-    # create if not exists
-    cur.execute("SELECT COUNT(*) FROM missions")
-    if cur.fetchone()[0] == 0:
-        # mission 1: refer 1 friend
-        cur.execute("INSERT INTO missions (code, title, description, reward, condition_json) VALUES (?, ?, ?, ?, ?)",
-                    ("ref1", "Taklif et 1 do'st", "1 do'st taklif eting va +4 rubl oling", 4.0, json.dumps({"referrals":1})))
-        # mission 2: daily spin (just example)
-        cur.execute("INSERT INTO missions (code, title, description, reward, condition_json) VALUES (?, ?, ?, ?, ?)",
-                    ("spin1", "Bepul Spin", "Bepul spin bajarish", 0.5, json.dumps({"spins":1})))
-        db_commit()
-
-def check_and_apply_missions_for_user(user_id: int):
-    # naive implementation: check missions and grant reward if condition met and not yet completed
-    cur.execute("SELECT id, condition_json, reward FROM missions")
-    rows = cur.fetchall()
-    for mid, cond_json, reward in rows:
-        cond = json.loads(cond_json)
-        # check if already completed
-        cur.execute("SELECT completed FROM user_missions WHERE user_id=? AND mission_id=?", (user_id, mid))
-        rr = cur.fetchone()
-        if rr and rr[0]==1:
-            continue
-        ok = True
-        # referrals condition
-        if cond.get("referrals"):
-            cur.execute("SELECT COUNT(*) FROM referrals WHERE referrer=?", (user_id,))
-            count = cur.fetchone()[0]
-            if count < cond["referrals"]:
-                ok = False
-        if cond.get("spins"):
-            cur.execute("SELECT COUNT(*) FROM spins WHERE user_id=?", (user_id,))
-            sc = cur.fetchone()[0]
-            if sc < cond["spins"]:
-                ok = False
-        # other conditions could be added
-        if ok:
-            # mark completed and reward
-            cur.execute("INSERT OR REPLACE INTO user_missions (user_id, mission_id, progress_json, completed, completed_at) VALUES (?, ?, ?, 1, datetime('now'))",
-                        (user_id, mid, json.dumps({"auto":True})))
-            add_transaction(user_id, "mission_reward", reward, f"mission {mid}")
-            notify_admin(None, f"🏅 Mission completed: user {user_id} mission {mid} reward {reward}")
-    db_commit()
+async def create_sample_missions(db: aiosqlite.Connection):
+    # create if not exists (runs on the caller's writer connection)
+    async with db.execute("SELECT EXISTS (SELECT 1 FROM missions)") as c:
+        seeded = (await c.fetchone())[0]
+    if not seeded:
+        await db.executemany("INSERT INTO missions (code, title, description, reward, condition_json) VALUES (?, ?, ?, ?, ?)", [
+            # mission 1: refer 1 friend
+            ("ref1", "Taklif et 1 do'st", "1 do'st taklif eting va +4 rubl oling", 400, dumps_json({"referrals":1})),
+            # mission 2: daily spin (just example)
+            ("spin1", "Bepul Spin", "Bepul spin bajarish", 50, dumps_json({"spins":1})),
+        ])
+
+async def shop_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # placeholder until the shop exists
+    await update.message.reply_text("Shop hozircha ochilmagan.")
 
 # ----- LEADERBOARD -----
+# rendered top-10 shared by all users; dropped early when someone on the board gets a transaction
+_lb_cache = {"text": None, "ts": 0.0, "ids": frozenset()}
+
+def invalidate_leaderboard(user_id: int):
+    if user_id in _lb_cache["ids"]:
+        _lb_cache["ts"] = 0.0
+
 async def leaderboard_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cur.execute("SELECT id, username, balance FROM users ORDER BY balance DESC LIMIT 10")
-    rows = cur.fetchall()
+    now = time.monotonic()
+    if _lb_cache["text"] and now - _lb_cache["ts"] < LEADERBOARD_TTL:
+        await update.message.reply_text(_lb_cache["text"])
+        return
+    async with pool.reader() as db:
+        async with db.execute("SELECT id, username, balance FROM users ORDER BY balance DESC LIMIT 10") as c:
+            rows = await c.fetchall()
     text = "🏆 Leaderboard (Top 10 by balance):\n"
     rank = 1
     for uid, username, bal in rows:
         uname = f"@{username}" if username else str(uid)
-        text += f"{rank}. {uname} — {safe_round(bal)} rubl\n"
+        text += f"{rank}. {uname} — {fmt_rub(bal)} rubl\n"
         rank += 1
+    _lb_cache.update(text=text, ts=now, ids=frozenset(uid for uid, _, _ in rows))
     await update.message.reply_text(text)
 
 # ----- ADMIN COMMANDS (simple) -----
 async def admin_stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # only allow admin channel or developer (for simplicity allow chat id of ADMIN_CHANNEL is channel - can't check easily)
     # show basic stats
-    cur.execute("SELECT COUNT(*) FROM users")
-    users_count = cur.fetchone()[0]
-    cur.execute("SELECT SUM(balance) FROM users")
-    total_balance = cur.fetchone()[0] or 0.0
-    cur.execute("SELECT COUNT(*) FROM orders WHERE status='new'")
-    new_orders = cur.fetchone()[0]
-    await update.message.reply_text(f"📊 Stats:\nUsers: {users_count}\nTotal virtual balance: {safe_round(total_balance)}\nNew orders: {new_orders}")
+    async with pool.reader() as db:
+        async with db.execute("SELECT COUNT(*) FROM users") as c:
+            users_count = (await c.fetchone())[0]
+        async with db.execute("SELECT SUM(balance) FROM users") as c:
+            total_balance = (await c.fetchone())[0] or 0
+        async with db.execute("SELECT COUNT(*) FROM orders WHERE status='new'") as c:
+            new_orders = (await c.fetchone())[0]
+    await update.message.reply_text(f"📊 Stats:\nUsers: {users_count}\nTotal virtual balance: {fmt_rub(total_balance)}\nNew orders: {new_orders}")
 
 async def admin_add_balance_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # /addbal <user_id> <amount>
@@ -675,124 +939,241 @@ async def admin_add_balance_cmd(update: Update, context: ContextTypes.DEFAULT_TY
         return
     try:
         uid = int(context.args[0])
-        amt = float(context.args[1])
+        amt = to_kop(float(context.args[1]))
     except:
         await update.message.reply_text("Invalid args")
         return
-    ensure_user(uid)
-    add_transaction(uid, "admin_adjust", amt, f"Admin adjustment by {update.effective_user.id}")
-    await update.message.reply_text(f"✅ {amt} rubl qo'shildi user {uid}")
+    await ensure_user(uid)
+    await add_transaction(uid, "admin_adjust", amt, f"Admin adjustment by {update.effective_user.id}")
+    await update.message.reply_text(f"✅ {fmt_rub(amt)} rubl qo'shildi user {uid}")
+
+async def orders_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # placeholder for an orders admin panel
+    await update.message.reply_text("Orders admin panel not implemented.")
+
+# ----- DAILY AUDIT (daily loop) -----
+# every (user, mission) pair whose condition is met and that is not completed yet;
+# a condition key that is missing or 0 does not restrict
+MISSION_COMPLETIONS_SQL = """
+    INSERT INTO temp.mission_completions (user_id, mission_id, reward)
+    SELECT u.id, m.id, m.reward
+    FROM users u
+    CROSS JOIN missions m
+    LEFT JOIN user_missions um ON um.user_id = u.id AND um.mission_id = m.id
+    WHERE COALESCE(um.completed, 0) = 0
+      AND (COALESCE(json_extract(m.condition_json, '$.referrals'), 0) = 0
+           OR (SELECT COUNT(*) FROM referrals r WHERE r.referrer = u.id) >= json_extract(m.condition_json, '$.referrals'))
+      AND (COALESCE(json_extract(m.condition_json, '$.spins'), 0) = 0
+           OR (SELECT COUNT(*) FROM spins s WHERE s.user_id = u.id) >= json_extract(m.condition_json, '$.spins'))
+"""
 
-# ----- DAILY AUDIT (scheduler job) -----
 async def daily_audit_job(app):
-    """Run daily audits: missions, reset daily_sent, check manual penalties etc."""
+    """Run daily audits: missions, reset daily_sent, check manual penalties etc.
+
+    Everything runs as set-based SQL inside a single write transaction.
+    """
     logger.info("Running daily audit job...")
-    # reset daily_sent for all users
-    cur.execute("UPDATE users SET daily_sent = 0")
-    db_commit()
-    # apply missions automatically
-    cur.execute("SELECT id FROM users")
-    rows = cur.fetchall()
-    for (uid,) in rows:
-        try:
-            check_and_apply_missions_for_user(uid)
-        except Exception as e:
-            logger.error("Mission apply error for %s: %s", uid, e)
+    async with pool.writer() as db:
+        # reset daily_sent for all users
+        await db.execute("UPDATE users SET daily_sent = 0")
+        # apply missions automatically: collect completions once, then mark and pay them in bulk
+        # (trg_tx_balance credits the balances as the reward rows are inserted)
+        await db.execute("CREATE TEMP TABLE IF NOT EXISTS mission_completions (user_id INTEGER, mission_id INTEGER, reward INTEGER)")
+        await db.execute("DELETE FROM temp.mission_completions")
+        await db.execute(MISSION_COMPLETIONS_SQL)
+        await db.execute("""
+            INSERT OR REPLACE INTO user_missions (user_id, mission_id, progress_json, completed, completed_at)
+            SELECT user_id, mission_id, ?, 1, datetime('now') FROM temp.mission_completions
+        """, (dumps_json({"auto":True}),))
+        await db.execute("""
+            INSERT INTO transactions (user_id, type, amount, reason, meta)
+            SELECT user_id, 'mission_reward', reward, 'mission ' || mission_id, '{}' FROM temp.mission_completions
+        """)
+        async with db.execute("SELECT user_id, mission_id, reward FROM temp.mission_completions") as c:
+            completed = await c.fetchall()
+    for uid, mid, reward in completed:
+        notify_admin(app, f"🏅 Mission completed: user {uid} mission {mid} reward {fmt_rub(reward)}")
     # optionally run subscription checks (telegram channels) here (rate-limited)
-    logger.info("Daily audit done.")
+    logger.info("Daily audit done: %d missions completed.", len(completed))
+
+def seconds_until(at: datetime.time) -> float:
+    """Seconds from now until the next UTC occurrence of `at`"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    target = datetime.datetime.combine(now.date(), at, tzinfo=datetime.timezone.utc)
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return (target - now).total_seconds()
+
+async def daily_loop(app):
+    # runs daily_audit_job every day at DAILY_AUDIT_AT on the bot's own event loop
+    while True:
+        await asyncio.sleep(seconds_until(DAILY_AUDIT_AT))
+        try:
+            await daily_audit_job(app)
+        except Exception:
+            logger.exception("Daily audit failed")
 
 # --------------- SETUP SAMPLE DATA -----------------
-def setup_sample_questions():
-    # Only add sample if none exist
-    cur.execute("SELECT COUNT(*) FROM quiz_questions")
-    if cur.fetchone()[0] == 0:
+async def setup_sample_questions(db: aiosqlite.Connection):
+    # Only add sample if none exist (runs on the caller's writer connection)
+    async with db.execute("SELECT EXISTS (SELECT 1 FROM quiz_questions)") as c:
+        seeded = (await c.fetchone())[0]
+    if not seeded:
         qlist = [
-            ("O'zbekiston poytaxti qaysi?", ["Toshkent","Samarqand","Buxoro","Namangan"], 0, 0.5),
-            ("Python qaysi yil paydo bo'ldi?", ["1989","1991","1994","2000"], 1, 0.5),
-            ("Telegram kim tomonidan asos solingan?", ["Pavel Durov","Mark Zuckerberg","Elon Musk","Bill Gates"], 0, 0.5),
+            ("O'zbekiston poytaxti qaysi?", ["Toshkent","Samarqand","Buxoro","Namangan"], 0, 50),
+            ("Python qaysi yil paydo bo'ldi?", ["1989","1991","1994","2000"], 1, 50),
+            ("Telegram kim tomonidan asos solingan?", ["Pavel Durov","Mark Zuckerberg","Elon Musk","Bill Gates"], 0, 50),
         ]
-        for qtext, options, ans, reward in qlist:
-            cur.execute("INSERT INTO quiz_questions (q, options, answer_index, reward) VALUES (?, ?, ?, ?)",
-                        (qtext, json.dumps(options, ensure_ascii=False), ans, reward))
-        db_commit()
+        await db.executemany("INSERT INTO quiz_questions (q, options, answer_index, reward) VALUES (?, ?, ?, ?)",
+                             [(qtext, dumps_json(options), ans, reward) for qtext, options, ans, reward in qlist])
 
 # --------------- HANDLERS & ROUTING -----------------
+# free text (not a /command); one filter object shared by every handler that takes typed input
+TEXT_NOT_COMMAND = filters.TEXT & ~filters.COMMAND
+
+# plain menu buttons -> handler
+BUTTON_ROUTES = {
+    "🎁 Kunlik bonus": daily_bonus_cmd,
+    "💰 Balansim": balance_cmd,
+    "📥 Tranzaksiyalar": transactions_cmd,
+    "🏆 Leaderboard": leaderboard_cmd,
+    "💠 Spin Wheel": spin_start,
+    "Spin Wheel": spin_start,
+    "🔗 Referal havola": start_handler,
+    "📤 Pul yuborish": send_start,
+    "🎯 Daily Quiz": quiz_start,
+    "🛒 Shop": shop_cmd,
+    "📝 Buyurtma berish": order_start,
+    "Buyurtma berish": order_start,
+}
+
+# /command -> handler
+COMMAND_ROUTES = {
+    "start": start_handler,
+    "balance": balance_cmd,
+    "transactions": transactions_cmd,
+    "leaderboard": leaderboard_cmd,
+    "admin_stats": admin_stats_cmd,
+    "addbal": admin_add_balance_cmd,
+    "spin": spin_start,
+    "daily_bonus": daily_bonus_cmd,
+    "send": send_start,
+    "quiz": quiz_start,
+    "orders": orders_cmd,
+}
+
+# first "|"-separated field of the inline button data -> handler
+CB_ROUTES = {
+    "quiz": quiz_answer_cb,  # quiz|qid|selected_index
+    "confirm_send": send_confirm,
+    "cancel_send": send_confirm,
+}
+
+# current user_data['step'] -> handler for the text typed at that step; it returns the next step (None ends the flow)
+STEP_ROUTES = {
+    SEND_RECIPIENT: send_recipient,
+    SEND_AMOUNT: send_amount,
+    ORDER_TEXT: order_message_handler,
+}
+
+async def button_dispatch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await BUTTON_ROUTES[update.message.text](update, context)
+
+async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    handler = CB_ROUTES.get(update.callback_query.data.split("|", 1)[0])
+    if handler is None:
+        # unknown or outdated button: just stop the client's loading spinner
+        await update.callback_query.answer()
+        return
+    return await handler(update, context)
+
+async def step_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    handler = STEP_ROUTES.get(context.user_data.get('step'))
+    if handler is not None:
+        context.user_data['step'] = await handler(update, context)
+
 def register_handlers(app):
-    # start
-    app.add_handler(CommandHandler("start", start_handler))
-    # simple commands
-    app.add_handler(CommandHandler("balance", balance_cmd))
-    app.add_handler(CommandHandler("transactions", transactions_cmd))
-    app.add_handler(CommandHandler("leaderboard", leaderboard_cmd))
-    app.add_handler(CommandHandler("admin_stats", admin_stats_cmd))
-    app.add_handler(CommandHandler("addbal", admin_add_balance_cmd))
-    # daily bonus text button maps
-    app.add_handler(MessageHandler(filters.Regex("^🎁 Kunlik bonus$"), daily_bonus_cmd))
-    app.add_handler(MessageHandler(filters.Regex("^💰 Balansim$"), balance_cmd))
-    app.add_handler(MessageHandler(filters.Regex("^📥 Tranzaksiyalar$"), transactions_cmd))
-    app.add_handler(MessageHandler(filters.Regex("^🏆 Leaderboard$"), leaderboard_cmd))
-    # Order flow: button triggers start
-    app.add_handler(MessageHandler(filters.Regex("^📝 Buyurtma berish$|^Buyurtma berish$"), order_start))
-    # handle any text for orders or fallback
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, order_message_handler))
-    # spin
-    app.add_handler(MessageHandler(filters.Regex("^💠 Spin Wheel$|^Spin Wheel$"), spin_start))
-    # referral link button
-    app.add_handler(MessageHandler(filters.Regex("^🔗 Referal havola$"), start_handler))
-    # shop placeholder
-    app.add_handler(MessageHandler(filters.Regex("^🛒 Shop$"), lambda u, c: u.message.reply_text("Shop hozircha ochilmagan."))
-    )
+    # commands (see COMMAND_ROUTES)
+    for name, handler in COMMAND_ROUTES.items():
+        app.add_handler(CommandHandler(name, handler))
+    # menu text buttons (see BUTTON_ROUTES)
+    app.add_handler(MessageHandler(filters.Text(frozenset(BUTTON_ROUTES)), button_dispatch))
 
-    # Conversation handlers
-    # send money conv
-    send_conv = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex("^📤 Pul yuborish$"), send_start), CommandHandler("send", send_start)],
-        states={
-            SEND_RECIPIENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_recipient)],
-            SEND_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_amount)],
-            SEND_CONFIRM: [CallbackQueryHandler(send_confirm, pattern="^(confirm_send|cancel_send)$")]
-        },
-        fallbacks=[],
-        per_user=True
-    )
-    app.add_handler(send_conv)
-
-    # quiz conv
-    quiz_conv = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex("^🎯 Daily Quiz$"), quiz_start), CommandHandler("quiz", quiz_start)],
-        states={
-            QUIZ_ASK: [],  # not used
-            QUIZ_ANSWER: [CallbackQueryHandler(quiz_answer_cb, pattern="^quiz\\|")]
-        },
-        fallbacks=[],
-        per_user=True
-    )
-    app.add_handler(quiz_conv)
+    # inline buttons (see CB_ROUTES)
+    app.add_handler(CallbackQueryHandler(callback_router))
 
-    # spin direct command
-    app.add_handler(CommandHandler("spin", spin_start))
-    app.add_handler(CommandHandler("daily_bonus", daily_bonus_cmd))
-    app.add_handler(CommandHandler("transactions", transactions_cmd))
-    app.add_handler(CommandHandler("orders", lambda u,c: c.bot.send_message(u.effective_chat.id, "Orders admin panel not implemented.")))
+    # typed input of the send and order flows (see STEP_ROUTES); registered last because it accepts any text,
+    # so menu buttons keep working while a flow waits
+    app.add_handler(MessageHandler(TEXT_NOT_COMMAND, step_router))
 
 # --------------- STARTUP -----------------
+def start_background(app, name: str, coro):
+    # long-lived task kept in bot_data; a crash is logged instead of vanishing with the task
+    task = asyncio.create_task(coro, name=name)
+    task.add_done_callback(_log_task_crash)
+    app.bot_data[name] = task
+
+def _log_task_crash(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task %s crashed", task.get_name(), exc_info=task.exception())
+
+async def on_startup(app):
+    # open the database and prepare sample data and missions
+    await pool.open()
+    # seeding is a pair of EXISTS probes once the tables have rows; both share one transaction
+    async with pool.writer() as db:
+        await setup_sample_questions(db)
+        await create_sample_missions(db)
+    await load_quiz_questions(app)
+    # the bot's username never changes while running; fetch it once for referral links
+    me = await app.bot.get_me()
+    app.bot_data['bot_username'] = me.username
+    # lines waiting for the admin channel; None tells admin_notifier to flush and stop.
+    # created here rather than at import so it belongs to the running loop (uvloop's, when installed)
+    app.bot_data['admin_queue'] = asyncio.Queue()
+    start_background(app, 'admin_notifier', admin_notifier(app))
+    start_background(app, 'daily_loop', daily_loop(app))
+
+async def on_stop(app):
+    daily = app.bot_data['daily_loop']
+    daily.cancel()
+    # let an interrupted audit roll back before on_shutdown closes the pool
+    with suppress(asyncio.CancelledError):
+        await daily
+    # flush queued admin notifications while the bot can still send
+    app.bot_data['admin_queue'].put_nowait(None)
+    # a crashed notifier was already logged by _log_task_crash
+    with suppress(Exception, asyncio.CancelledError):
+        await app.bot_data['admin_notifier']
+
+async def on_shutdown(app):
+    await pool.close()
+
 def main():
-    # prepare sample data and missions
-    setup_sample_questions()
-    create_sample_missions()
+    # optional faster event loop; run_polling/run_webhook pick it up through the loop policy
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        # same pool sizes ApplicationBuilder uses by default (256 for API calls, 1 for getUpdates)
+        .request(OrjsonRequest(connection_pool_size=256)).get_updates_request(OrjsonRequest())
+        .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown).build()
+    )
 
     # register handlers
     register_handlers(app)
 
-    # scheduler
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(lambda: app.create_task(daily_audit_job(app)), 'cron', hour=0, minute=5)  # run daily at 00:05 UTC
-    scheduler.start()
-
     logger.info("Bot starting...")
-    app.run_polling()
+    if WEBHOOK_URL:
+        app.run_webhook(listen="0.0.0.0", port=int(WEBHOOK_PORT), url_path=BOT_TOKEN,
+                        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{BOT_TOKEN}", secret_token=WEBHOOK_SECRET,
+                        max_connections=100)  # Telegram allows up to 100 parallel webhook requests
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()